@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import math
 import pathlib
+import re
 import subprocess
+import urllib.request
 from datetime import datetime
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.csv as pv
 import streamlit as st
 
 st.set_page_config(layout="wide", page_title="Phoenix Team Analyst 🐦‍🔥")
@@ -31,13 +37,29 @@ else:
 #   1. DETECCIÓN AUTOMÁTICA DE DISPOSITIVO (ESCRITORIO / MÓVIL)
 # ==============================================================================
 
-try:
-    from streamlit_javascript import st_javascript
+def _detect_viewport() -> int | None:
+    """Ancho de la ventana vía ``st_javascript`` (importado sólo si hace falta).
 
-    raw_vw = st_javascript("return window.innerWidth;")
-    viewport_width = int(float(raw_vw)) if raw_vw else 1200
-except Exception:
-    viewport_width = 1200  # Fallback escritorio
+    En el primer run el componente aún no responde y devuelve 0: se reintenta en
+    el siguiente rerun hasta obtener un ancho válido.
+    """
+
+    try:
+        from streamlit_javascript import st_javascript
+    except ImportError:
+        return None
+    try:
+        vw = float(st_javascript("return window.innerWidth;"))
+    except (TypeError, ValueError):
+        return None
+    return int(vw) if math.isfinite(vw) and vw > 0 else None
+
+
+if "viewport" not in st.session_state:
+    detected = _detect_viewport()
+    if detected:
+        st.session_state["viewport"] = detected
+viewport_width = st.session_state.get("viewport", 1200)  # Fallback escritorio
 
 is_mobile = viewport_width < 992  # Bootstrap md breakpoint
 
@@ -46,36 +68,101 @@ is_mobile = viewport_width < 992  # Bootstrap md breakpoint
 # ==============================================================================
 
 RAW_CSV_URL = "https://raw.githubusercontent.com/goatdev08/phoenix.dash/main/archivo.csv"
+FILTER_COLUMNS = ("Nadador", "Estilo", "Distancia", "Fase", "Parametro")
+
+# Grafías conocidas (en mayúsculas y sin acento) → fase canónica
+PHASE_MAP: dict[str, str] = {
+    "PRE-ELIMINAR": "Preliminar",
+    "PRELIMINAR": "Preliminar",
+    "PRE ELIMINAR": "Preliminar",
+    "SEMIFINAL": "Semifinal",
+    "SEMI-FINAL": "Semifinal",
+    "FINAL": "Final",
+}
+PHASE_ORDER = {"Preliminar": 1, "Semifinal": 2, "Final": 3}
+
+# Tipos explícitos para el lector de Arrow (evita la inferencia de tipos).
+# "Valor" se lee como texto: el CSV trae "N/A" y "#DIV/0!" y se convierte abajo.
+CSV_COLUMN_TYPES = {
+    "Nadador": pa.string(),
+    "Distancia": pa.int64(),
+    "Estilo": pa.string(),
+    "Cat_Prueba": pa.string(),
+    "Parametro": pa.string(),
+    "Valor": pa.string(),
+}
 
 
-@st.cache_data(show_spinner="📦 Cargando datos …")
+def _open_csv(path: str):
+    """Abre el CSV en binario, sea una URL o una ruta local."""
+
+    if "://" in path:
+        return urllib.request.urlopen(path)
+    return open(path, "rb")
+
+
+@st.cache_resource(show_spinner="📦 Cargando datos …")
 def load_data(path: str | None = None) -> pd.DataFrame:
-    """Carga el CSV remoto o local y normaliza columnas."""
+    """Carga el CSV remoto o local y normaliza columnas.
+
+    Se comparte entre sesiones sin serializar (``cache_resource``): el resultado
+    es de sólo lectura y nadie debe modificarlo en sitio.
+    """
 
     path = path or RAW_CSV_URL
-    df = pd.read_csv(path)
+    with _open_csv(path) as fh:
+        table = pv.read_csv(
+            fh,
+            convert_options=pv.ConvertOptions(
+                column_types=CSV_COLUMN_TYPES, strings_can_be_null=True
+            ),
+        )
+    # Columnas vacías (p. ej. "Competencia") llegan como nulas: se leen como float NaN
+    table = table.cast(
+        pa.schema(
+            [
+                pa.field(f.name, pa.float64()) if pa.types.is_null(f.type) else f
+                for f in table.schema
+            ]
+        )
+    )
+    df = table.to_pandas()
     df.columns = [c.strip().replace("/", "").replace(" ", "_") for c in df.columns]
 
     if "Cat_Prueba" in df.columns:
         df.rename(columns={"Cat_Prueba": "Fase"}, inplace=True)
 
-    phase_map = {
-        "PRE-ELIMINAR": "Preliminar",
-        "PRELIMINAR": "Preliminar",
-        "PRE ELIMINAR": "Preliminar",
-        "SEMIFINAL": "Semifinal",
-        "SEMI-FINAL": "Semifinal",
-        "FINAL": "Final",
-    }
-    df["Fase"] = df["Fase"].str.upper().str.replace("Ó", "O").map(phase_map).fillna(df["Fase"])
-    order_dict = {"Preliminar": 1, "Semifinal": 2, "Final": 3}
-    df["Fase_Orden"] = df["Fase"].map(order_dict)
+    # upper + acento + PHASE_MAP en una sola pasada sobre las grafías distintas;
+    # luego se traducen los códigos (-1/NaN cae en el -1 final), sin re-hashear N strings
+    fase_raw = df["Fase"].astype("category")
+    canon = [PHASE_MAP.get(f.upper().replace("Ó", "O"), f) for f in fase_raw.cat.categories]
+    fases = sorted(set(canon))
+    recode = np.array([fases.index(f) for f in canon] + [-1])
+    df["Fase"] = pd.Categorical.from_codes(
+        recode[fase_raw.cat.codes.to_numpy()], categories=fases
+    )
+    # Orden por categoría (pocas) e indexado por código; -1 (NaN) cae en el NaN final
+    orden = [PHASE_ORDER.get(c, np.nan) for c in df["Fase"].cat.categories]
+    fase_orden = np.append(orden, np.nan)[df["Fase"].cat.codes.to_numpy()]
+    # Entero cuando todas las fases son conocidas, como hacía ``map``
+    df["Fase_Orden"] = fase_orden if np.isnan(fase_orden).any() else fase_orden.astype(np.int64)
 
     df["Valor"] = pd.to_numeric(df["Valor"], errors="coerce")
+    df["_valor_ok"] = df["Valor"].notna().to_numpy()  # máscara compartida, 1 byte/fila
+    for c in FILTER_COLUMNS:
+        df[c] = df[c].astype("category")
     return df
 
 
+@st.cache_data
+def unique_values(_df: pd.DataFrame) -> dict[str, list]:
+    """Opciones únicas de cada columna filtrable, calculadas una sola vez."""
+
+    return {c: _df[c].unique().tolist() for c in FILTER_COLUMNS}
+
+
 df = load_data()
+opts = unique_values(df)
 
 # ==============================================================================
 #   3. CONSTANTES Y DICCIONARIOS
@@ -121,52 +208,109 @@ with st.sidebar:
     st.markdown("#### Filtros")
 
     sel_nadadores = st.multiselect(
-        "Selecciona hasta 4 nadadores:", df.Nadador.unique(), max_selections=4
+        "Selecciona hasta 4 nadadores:", opts["Nadador"], max_selections=4
     )
     sel_estilos = (
-        df.Estilo.unique().tolist()
+        opts["Estilo"]
         if st.checkbox("Todos los estilos")
-        else st.multiselect("Estilo(s):", df.Estilo.unique())
+        else st.multiselect("Estilo(s):", opts["Estilo"])
     )
     sel_pruebas = (
-        df.Distancia.unique().tolist()
+        opts["Distancia"]
         if st.checkbox("Todas las pruebas")
-        else st.multiselect("Prueba(s):", df.Distancia.unique())
+        else st.multiselect("Prueba(s):", opts["Distancia"])
     )
     sel_fases = (
-        df.Fase.unique().tolist()
+        opts["Fase"]
         if st.checkbox("Todas las fases")
-        else st.multiselect("Fase(s):", df.Fase.unique())
+        else st.multiselect("Fase(s):", opts["Fase"])
     )
     sel_parametros = (
-        df.Parametro.unique().tolist()
+        opts["Parametro"]
         if st.checkbox("Todos los parámetros")
-        else st.multiselect("Parámetro(s):", df.Parametro.unique())
+        else st.multiselect("Parámetro(s):", opts["Parametro"])
     )
 
 # ==============================================================================
 #   5. FILTRADO DE DATAFRAME
 # ==============================================================================
 
-filtered_df = df[
-    df.Nadador.isin(sel_nadadores)
-    & df.Estilo.isin(sel_estilos)
-    & df.Distancia.isin(sel_pruebas)
-    & df.Fase.isin(sel_fases)
-    & df.Parametro.isin(sel_parametros)
-]
+def filter_mask(df: pd.DataFrame, selections: dict[str, list]) -> np.ndarray:
+    """Máscara booleana combinada sobre los códigos de las columnas categóricas."""
+
+    masks = []
+    for col, sel in selections.items():
+        categories = df[col].cat.categories
+        allowed = categories.get_indexer(list(sel))
+        # Tabla de pertenencia por código; la última celda (False) recibe el -1 (NaN)
+        lut = np.zeros(len(categories) + 1, dtype=bool)
+        lut[allowed[allowed >= 0]] = True
+        masks.append(lut[df[col].cat.codes.to_numpy()])
+    return np.logical_and.reduce(masks)
+
+
+@st.cache_data(show_spinner=False)
+def compute_view(
+    _df: pd.DataFrame,
+    nad: tuple,
+    est: tuple,
+    pru: tuple,
+    fas: tuple,
+    par: tuple,
+) -> tuple[pd.DataFrame, dict, dict]:
+    """Filtra ``_df`` y arma el índice (Parametro, Estilo) → sub-DataFrame.
+
+    El caché se indexa sólo por las selecciones, de modo que los reruns que no
+    las cambian (pestañas, leyendas, checkboxes) reutilizan la vista completa.
+    """
+
+    visibles = [c for c in _df.columns if not c.startswith("_")]  # sin columnas internas
+    filtered = _df.loc[
+        filter_mask(
+            _df,
+            {"Nadador": nad, "Estilo": est, "Distancia": pru, "Fase": fas, "Parametro": par},
+        ),
+        visibles,
+    ]
+    grupos = {
+        k: v for k, v in filtered.groupby(["Parametro", "Estilo"], observed=True, sort=False)
+    }
+    estilos = filtered.groupby("Parametro", observed=True)["Estilo"].unique().to_dict()
+    return filtered, grupos, estilos
+
+
+# Clave canónica de filtros: el orden de selección no altera la vista
+# (``key=str`` porque las opciones "Todos" pueden traer NaN de celdas vacías)
+selection_key = (
+    tuple(sorted(sel_nadadores, key=str)),
+    tuple(sorted(sel_estilos, key=str)),
+    tuple(sorted(sel_pruebas, key=str)),
+    tuple(sorted(sel_fases, key=str)),
+    tuple(sorted(sel_parametros, key=str)),
+)
+filtered_df, groups, param_estilos = compute_view(df, *selection_key)
+present_params = set(param_estilos)
 
 # ==============================================================================
 #   6. DESCARGA DE CSV FILTRADO
 # ==============================================================================
 
-csv_data = filtered_df.to_csv(index=False).encode("utf-8")
-st.sidebar.download_button(
-    label="📥 Descargar datos filtrados",
-    data=csv_data,
-    file_name=f"Phoenix_filtered_{datetime.now():%Y%m%d}.csv",
-    mime="text/csv",
-)
+@st.cache_data(show_spinner=False)
+def encode_csv(_df: pd.DataFrame, key: tuple) -> bytes:
+    """CSV UTF-8 del DataFrame filtrado; ``key`` (selecciones) decide el caché."""
+
+    return _df.to_csv(index=False).encode("utf-8")
+
+
+if not filtered_df.empty:
+    csv_data = encode_csv(filtered_df, selection_key)
+    today = st.session_state.setdefault("today", datetime.now().strftime("%Y%m%d"))
+    st.sidebar.download_button(
+        label="📥 Descargar datos filtrados",
+        data=csv_data,
+        file_name=f"Phoenix_filtered_{today}.csv",
+        mime="text/csv",
+    )
 
 # ==============================================================================
 #   7. TABS PRINCIPALES (Gráficos y Detalles)
@@ -182,17 +326,24 @@ tab_graficos, tab_detalles = st.tabs([
 # ------------------------------------------------------------------------------
 
 def make_line_fig(df_subset: pd.DataFrame, titulo: str):
-    fig = px.line(
-        df_subset,
-        x="Fase_Orden",
-        y="Valor",
-        color="Nadador",
-        markers=True,
-        line_group="Nadador",
-        hover_data={"Fase": True, "Fase_Orden": False},
-        title=titulo,
-        category_orders={"Fase_Orden": [1, 2, 3]},
-    )
+    """Una traza por nadador (Fase_Orden vs Valor), sin pasar por plotly.express."""
+
+    fig = go.Figure()
+    for nad, sub in df_subset.groupby("Nadador", sort=False, observed=True):
+        fig.add_trace(
+            go.Scatter(
+                x=sub["Fase_Orden"].to_numpy(),
+                y=sub["Valor"].to_numpy(),
+                customdata=sub["Fase"].to_numpy(),
+                name=nad,
+                legendgroup=nad,
+                mode="lines+markers",
+                hovertemplate=(
+                    "Nadador=%{fullData.name}<br>Valor=%{y}<br>Fase=%{customdata}<extra></extra>"
+                ),
+            )
+        )
+    fig.update_layout(title=titulo, legend_title_text="Nadador", yaxis_title="Valor")
     fig.update_xaxes(
         tickvals=[1, 2, 3],
         ticktext=["Preliminar", "Semifinal", "Final"],
@@ -200,28 +351,56 @@ def make_line_fig(df_subset: pd.DataFrame, titulo: str):
     )
     return fig
 
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def cached_line_fig(
+    parametro: str,
+    estilo: str,
+    view_key: tuple,
+    mobile: bool,
+    _df_subset: pd.DataFrame,
+    _titulo: str,
+):
+    """Figura ya maquetada; ``_df_subset`` queda fuera de la clave de caché.
+
+    ``view_key`` (las selecciones) junto con ``parametro`` y ``estilo`` determina
+    el sub-DataFrame por completo, así que no hace falta hashearlo.
+    """
+
+    fig = make_line_fig(_df_subset, _titulo)
+    fig.update_layout(
+        legend=dict(orientation="h", y=-0.25, x=0.5, xanchor="center"),
+        height=320 if mobile else 500,
+        margin=dict(t=50, b=40),
+    )
+    return fig
+
+
 with tab_graficos:
     if sel_estilos:
         st.markdown("**Estilos seleccionados:** " + ", ".join(sel_estilos))
-    for categoria, lista_param in param_categories.items():
-        presentes = [p for p in lista_param if p in filtered_df.Parametro.unique()]
-        if not presentes:
-            continue
-        st.subheader(categoria)
-        for parametro in presentes:
-            nombre_legible = param_translation.get(parametro, parametro)
-            df_param = filtered_df[filtered_df.Parametro == parametro]
-            estilos_unicos = df_param.Estilo.unique()
-            cols = st.columns(len(estilos_unicos)) if len(estilos_unicos) > 1 else [st]
-            for idx, estilo in enumerate(estilos_unicos):
-                df_estilo = df_param[df_param.Estilo == estilo]
-                fig = make_line_fig(df_estilo, f"{nombre_legible} – {estilo}")
-                fig.update_layout(
-                    legend=dict(orientation="h", y=-0.25, x=0.5, xanchor="center"),
-                    height=320 if is_mobile else 500,
-                    margin=dict(t=50, b=40),
-                )
-                cols[idx].plotly_chart(fig, use_container_width=True)
+    if filtered_df.empty:
+        st.info("Selecciona filtros para visualizar los gráficos.")
+    else:
+        for categoria, lista_param in param_categories.items():
+            presentes = [p for p in lista_param if p in present_params]
+            if not presentes:
+                continue
+            st.subheader(categoria)
+            for parametro in presentes:
+                nombre_legible = param_translation.get(parametro, parametro)
+                estilos_unicos = param_estilos[parametro]
+                cols = st.columns(len(estilos_unicos)) if len(estilos_unicos) > 1 else [st]
+                for idx, estilo in enumerate(estilos_unicos):
+                    fig = cached_line_fig(
+                        parametro,
+                        estilo,
+                        selection_key,
+                        is_mobile,
+                        groups.get((parametro, estilo)),
+                        f"{nombre_legible} – {estilo}",
+                    )
+                    cols[idx].plotly_chart(fig, use_container_width=True)
 
 # ------------------------------------------------------------------------------
 #   7.2 DETALLES POR NADADOR
@@ -229,14 +408,17 @@ with tab_graficos:
 
 with tab_detalles:
     if sel_nadadores:
+        # Traducción sobre las categorías (una vez) y partición única por nadador
+        detalle_df = filtered_df.assign(
+            Parametro=filtered_df["Parametro"].cat.rename_categories(
+                lambda p: param_translation.get(p, p)
+            )
+        )
+        groups_nad = dict(list(detalle_df.groupby("Nadador", observed=True, sort=False)))
         for nadador in sel_nadadores:
             st.markdown(f"### {nadador}")
-            sub_df = filtered_df[filtered_df.Nadador == nadador].copy()
-            sub_df["Parametro"] = sub_df["Parametro"].map(param_translation).fillna(
-                sub_df["Parametro"]
-            )
             st.dataframe(
-                sub_df,
+                groups_nad.get(nadador, detalle_df.iloc[:0]),
                 use_container_width=True,
                 height=300 if is_mobile else 600,
             )
@@ -247,31 +429,70 @@ with tab_detalles:
 #   8. RANKING GLOBAL (cuando no se selecciona nadador)
 # ==============================================================================
 
+RANKING_KEYS = ["Estilo", "Distancia", "Nadador"]
+# Inicial del primer nombre (lookahead, sin consumir) + último apellido
+_ABBREV_RE = re.compile(r"^\s*(?=(\S))(?:.*\s)?(\S+)\s*$")
+
+
+@st.cache_data(show_spinner=False)
+def ranking_base(_df: pd.DataFrame) -> pd.DataFrame:
+    """Filas de "T TOTAL" con valor, con las claves de agrupación compactadas."""
+
+    mask = filter_mask(_df, {"Parametro": ["T TOTAL"]}) & _df["_valor_ok"].to_numpy()
+    base = _df[mask].copy()
+    for c in RANKING_KEYS:
+        base[c] = base[c].cat.remove_unused_categories()
+    return base
+
+
+@st.cache_data(show_spinner=False)
+def ranking_table(_df: pd.DataFrame, mobile: bool) -> pd.DataFrame:
+    """Mejor tiempo total por estilo, prueba y nadador, ya ordenado."""
+
+    ranking = (
+        ranking_base(_df)
+        .groupby(RANKING_KEYS, as_index=False, observed=True)["Valor"]
+        .min()
+    )
+    if mobile:
+        parts = ranking["Nadador"].str.extract(_ABBREV_RE)
+        ranking["Nadador"] = parts[0] + ". " + parts[1]
+    return ranking.sort_values(by=["Estilo", "Distancia", "Valor"])
+
+
 if not sel_nadadores:
+    import plotly.express as px
+
     st.header("🏆 Ranking de Nadadores por Estilo y Prueba (Tiempo Total)")
-    ranking_df = (
-        df[df.Parametro == "T TOTAL"]
-        .dropna(subset=["Valor"])
-        .groupby(["Estilo", "Distancia", "Nadador"], as_index=False)["Valor"].min()
+    ranking_df = ranking_table(df, is_mobile)
+    # Un panel por (estilo, prueba) con datos, en el orden ya ordenado del ranking
+    ranking_plot = ranking_df.assign(
+        Prueba=ranking_df["Estilo"].astype(str)
+        + " – "
+        + ranking_df["Distancia"].astype(str)
+        + "m"
     )
-    if is_mobile:
-        ranking_df["Nadador"] = ranking_df["Nadador"].apply(
-            lambda x: f"{x.split()[0][0]}. {x.split()[-1]}"
-        )
-    ranking_df = ranking_df.sort_values(by=["Estilo", "Distancia", "Valor"])
-    for (estilo, distancia), grp in ranking_df.groupby(["Estilo", "Distancia"]):
-        st.subheader(f"{estilo} – {distancia}m")
-        fig_rank = px.bar(
-            grp,
-            x="Nadador",
-            y="Valor",
-            color="Nadador",
-            labels={"Valor": "Tiempo Total (s)"},
-            title=f"Ranking – {estilo} {distancia}m",
-        )
-        fig_rank.update_layout(showlegend=False, height=350 if is_mobile else 520)
-        st.plotly_chart(fig_rank, use_container_width=True)
-        st.dataframe(grp, use_container_width=True, height=250 if is_mobile else 400)
+    n_cols = 1 if is_mobile else 3
+    n_paneles = max(ranking_plot["Prueba"].nunique(), 1)
+    n_filas = -(-n_paneles // n_cols)
+    fig_rank = px.bar(
+        ranking_plot,
+        x="Nadador",
+        y="Valor",
+        color="Nadador",
+        facet_col="Prueba",
+        facet_col_wrap=n_cols,
+        facet_row_spacing=min(0.08, 0.9 / max(n_filas - 1, 1)),
+        labels={"Valor": "Tiempo Total (s)"},
+        title="Ranking – Tiempo Total",
+    )
+    fig_rank.for_each_annotation(lambda a: a.update(text=a.text.split("=", 1)[-1]))
+    # Cada panel con sus propios ejes (y con escala visible), del más rápido al más lento
+    fig_rank.update_xaxes(matches=None, showticklabels=True, categoryorder="total ascending")
+    fig_rank.update_yaxes(matches=None, showticklabels=True)
+    fig_rank.update_layout(showlegend=False, height=(350 if is_mobile else 520) * n_filas)
+    st.plotly_chart(fig_rank, use_container_width=True)
+    st.dataframe(ranking_df, use_container_width=True, height=250 if is_mobile else 400)
 
 # ==============================================================================
 #   FOOTER